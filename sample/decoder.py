@@ -15,125 +15,229 @@ This decoder is robust-ish because it *learns* the two bit waveforms from the WA
 (using a simple 2-cluster k-means over 32-sample blocks).
 """
 
+import functools
 import sys
 import wave
+from array import array
 import numpy as np
-from typing import List, Optional, Tuple
-
+from typing import Optional, Tuple
 
 BIT_SAMPLES = 32
+CALIBRATION_BLOCKS = 4096  # k-means sample: 4096 bits = 256 KB of 16-bit mono
+CALIBRATION_RUN = 64  # ...read as 64 runs of 64 consecutive bits spread over the file
+# calibration blocks train k-means only if their variance exceeds
+# CALIBRATION_ENERGY_RATIO x the CALIBRATION_ENERGY_PERCENTILE-th percentile variance,
+# i.e. roughly 1/3 of the typical signal amplitude; silence and low noise are left out
+CALIBRATION_ENERGY_RATIO = 0.1
+CALIBRATION_ENERGY_PERCENTILE = 95
+STREAM_BLOCKS = 1024  # bits are labelled 64 KB (16-bit mono) at a time
+CRC16_POLY = 0x1021
+
+
+@functools.lru_cache(maxsize=4)
+def _make_crc16_table(poly: int) -> array:
+    # Sarwate table: CRC of each possible leading byte, run through the bit loop once
+    table = array("H")
+    for b in range(256):
+        crc = b << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFFFF if (crc & 0x8000) else (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
 
 
-def read_wav_int16(path: str) -> Tuple[np.ndarray, int]:
-    with wave.open(path, "rb") as wf:
-        nch = wf.getnchannels()
-        sampwidth = wf.getsampwidth()
-        rate = wf.getframerate()
-        nframes = wf.getnframes()
-        raw = wf.readframes(nframes)
+# per-byte bit reversal (MSB-first <-> LSB-first)
+_BIT_REV = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+_BIT_REV_NP = np.frombuffer(_BIT_REV, dtype=np.uint8)
+
 
-    if sampwidth != 2:
-        raise ValueError(f"Unsupported sample width: {sampwidth} bytes (expected 16-bit PCM)")
+def _int16_le_samples(raw: bytes) -> np.ndarray:
+    # zero-copy view when the buffer is already native-endian and aligned;
+    # otherwise one aligned copy via array.array (byteswapped on big-endian hosts)
+    samples = np.frombuffer(raw, dtype=np.int16)
+    if sys.byteorder == "little" and samples.flags.aligned:
+        return samples
+    arr = array("h")
+    arr.frombytes(raw)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return np.frombuffer(arr, dtype=np.int16)
 
-    data = np.frombuffer(raw, dtype="<i2").astype(np.float32)
+
+def _pcm_to_mono(raw: bytes, nch: int) -> np.ndarray:
+    raw_i16 = _int16_le_samples(raw)
 
     if nch == 2:
-        # Downmix stereo to mono
-        data = data.reshape(-1, 2).mean(axis=1)
-    elif nch != 1:
+        # Downmix stereo to mono (cast one channel, accumulate the other in place)
+        pairs = raw_i16.reshape(-1, 2)
+        data = pairs[:, 0].astype(np.float32)
+        data += pairs[:, 1]
+        data *= 0.5
+    elif nch == 1:
+        data = raw_i16.astype(np.float32)
+    else:
         raise ValueError(f"Unsupported channels: {nch} (expected 1 or 2)")
 
+    return data
+
+
+def _check_sample_width(wf: wave.Wave_read) -> None:
+    if wf.getsampwidth() != 2:
+        raise ValueError(f"Unsupported sample width: {wf.getsampwidth()} bytes (expected 16-bit PCM)")
+
+
+def read_wav_int16(path: str) -> Tuple[np.ndarray, int]:
+    """Read a whole 16-bit WAV as float32 mono samples. Returns (samples, rate)."""
+    with wave.open(path, "rb") as wf:
+        _check_sample_width(wf)
+        rate = wf.getframerate()
+        data = _pcm_to_mono(wf.readframes(wf.getnframes()), wf.getnchannels())
     return data, rate
 
 
+def read_wav_blocks(wf: wave.Wave_read, start_block: int, n_blocks: int) -> np.ndarray:
+    """
+    Read n_blocks bits (32 samples each) of an open 16-bit WAV, starting at start_block.
+    Returns (n, 32) float32 mono blocks; n is smaller at the end of the file.
+    """
+    _check_sample_width(wf)
+
+    wf.setpos(start_block * BIT_SAMPLES)
+    pcm = _pcm_to_mono(wf.readframes(n_blocks * BIT_SAMPLES), wf.getnchannels())
+    n = len(pcm) // BIT_SAMPLES
+    return pcm[:n * BIT_SAMPLES].reshape(n, BIT_SAMPLES)
+
+
+def read_calibration_blocks(wf: wave.Wave_read, n_blocks: int) -> np.ndarray:
+    """
+    Up to CALIBRATION_BLOCKS blocks for k-means, taken as short runs spread evenly
+    over the whole file so leading/trailing silence or noise cannot fill the set.
+    """
+    if n_blocks <= CALIBRATION_BLOCKS:
+        return read_wav_blocks(wf, 0, n_blocks)
+
+    n_runs = CALIBRATION_BLOCKS // CALIBRATION_RUN
+    starts = np.linspace(0, n_blocks - CALIBRATION_RUN, n_runs).astype(np.int64)
+    return np.concatenate([read_wav_blocks(wf, int(s), CALIBRATION_RUN) for s in starts])
+
+
 def normalize_blocks(x: np.ndarray) -> np.ndarray:
-    # x: (N, 32)
-    x = x - x.mean(axis=1, keepdims=True)
-    norm = np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
-    return x / norm
+    # x: (N, 32), normalized in place (pass a copy if the caller still needs it)
+    x -= x.mean(axis=1, keepdims=True)
+    inv = 1.0 / np.sqrt(np.einsum("ij,ij->i", x, x) + 1e-12)
+    x *= inv[:, None]
+    return x
+
+
+def split_plane(c: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Decision plane between 2 centroids: a block x is nearer c[1] than c[0]
+    exactly when x @ w > b. Returns (w, b).
+    """
+    w = c[1] - c[0]
+    b = 0.5 * (c[1] @ c[1] - c[0] @ c[0])
+    return w, b
 
 
 def kmeans2(x: np.ndarray, iters: int = 30, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
     """
     Very small 2-means:
       returns (centroids[2,32], labels[N])
+    With k=2, "nearer to c1 than c0" reduces to x.(c1-c0) > (||c1||^2-||c0||^2)/2,
+    so each assignment pass is a single matvec plus a threshold.
     """
+    # float32 keeps the projection on BLAS SGEMV; NumPy has no BLAS path for float16,
+    # so a reduced-precision copy would be slower, not faster
+    x = np.ascontiguousarray(x, dtype=np.float32)
     rng = np.random.default_rng(seed)
     n = x.shape[0]
-    # init: pick 2 random distinct samples
-    idx = rng.choice(n, size=2, replace=False)
-    c = x[idx].copy()  # (2,32)
-
+    # init (k-means++): a random sample, then a second one drawn with probability
+    # proportional to its squared distance from the first (2 - 2cos for unit rows)
+    c = np.empty((2, x.shape[1]), dtype=x.dtype)  # (2,32)
+    c[0] = x[rng.integers(n)]
+    d = np.einsum("ij,ij->i", x, x) + c[0] @ c[0] - 2 * (x @ c[0])
+    d = np.maximum(d, 0).astype(np.float64)
+    total = d.sum()
+    c[1] = x[rng.choice(n, p=d / total)] if total > 0 else x[rng.integers(n)]
+
+    proj = np.empty(n, dtype=x.dtype)  # reused by every assignment pass
+    onehot = np.empty((2, n), dtype=x.dtype)  # cluster membership rows for the update
+
+    def assign(c: np.ndarray) -> np.ndarray:
+        w, b = split_plane(c)
+        np.matmul(x, w, out=proj)
+        return (proj > b).astype(np.int32)
+
+    labels = None
     for _ in range(iters):
         # assign
-        d0 = np.sum((x - c[0]) ** 2, axis=1)
-        d1 = np.sum((x - c[1]) ** 2, axis=1)
-        labels = (d1 < d0).astype(np.int32)
-
-        # update
-        new_c = c.copy()
-        for k in (0, 1):
-            m = x[labels == k]
-            if len(m) > 0:
-                new_c[k] = m.mean(axis=0)
-        # convergence
-        if np.allclose(new_c, c, atol=1e-6):
-            c = new_c
+        new_labels = assign(c)
+        # convergence: same assignment -> same centroids
+        if labels is not None and np.array_equal(new_labels, labels):
             break
-        c = new_c
+        labels = new_labels
+
+        # update (empty cluster keeps its previous centroid):
+        # per-cluster sums as one (2,N) @ (N,32) pass, no boolean-mask copies of x
+        counts = np.bincount(labels, minlength=2)
+        onehot[1] = labels
+        np.subtract(1, onehot[1], out=onehot[0])
+        sums = onehot @ x
+        nz = counts > 0
+        c[nz] = sums[nz] / counts[nz, None]
 
     # final labels
-    d0 = np.sum((x - c[0]) ** 2, axis=1)
-    d1 = np.sum((x - c[1]) ** 2, axis=1)
-    labels = (d1 < d0).astype(np.int32)
+    labels = assign(c)
 
     return c, labels
 
 
-def crc16_xmodem(data: bytes, poly: int = 0x1021, init: int = 0x0000) -> int:
-    crc = init
+def crc16_xmodem(data: bytes, poly: int = CRC16_POLY, init: int = 0x0000) -> int:
+    table = _make_crc16_table(poly & 0xFFFF)
+    crc = init & 0xFFFF
     for b in data:
-        crc ^= (b << 8)
-        for _ in range(8):
-            crc = ((crc << 1) ^ poly) & 0xFFFF if (crc & 0x8000) else (crc << 1) & 0xFFFF
-    return crc & 0xFFFF
+        crc = ((crc << 8) ^ table[((crc >> 8) ^ b) & 0xFF]) & 0xFFFF
+    return crc
 
 
-def crc16_ccitt_false(data: bytes, poly: int = 0x1021, init: int = 0xFFFF) -> int:
+def crc16_ccitt_false(data: bytes, poly: int = CRC16_POLY, init: int = 0xFFFF) -> int:
     return crc16_xmodem(data, poly=poly, init=init)
 
 
-def bits_to_bytes_uart(bits: List[int], start_pos: int, max_bytes: int = 20000) -> Tuple[bytes, int]:
+def crc16_xmodem_np(buf: np.ndarray, init: int = 0x0000) -> int:
+    """
+    CRC16-XMODEM over a uint8 array (e.g. np.frombuffer(data, dtype=np.uint8)).
+    Same result as crc16_xmodem(); use init=0xFFFF for CCITT-FALSE.
+    """
+    return crc16_xmodem(buf.tobytes(), init=init)
+
+
+def bits_to_bytes_uart(bits: np.ndarray, start_pos: int, max_bytes: int = 20000) -> Tuple[bytes, int]:
     """
-    Parse UART-framed bytes from bits starting at start_pos.
+    Parse UART-framed bytes from bits (uint8 array) starting at start_pos.
     Returns (payload_bytes, end_pos_bits).
     Stops when framing breaks or max_bytes reached.
     """
-    out = bytearray()
-    i = start_pos
-    n = len(bits)
-
-    while i + 10 <= n and len(out) < max_bytes:
-        if bits[i] != 0:
-            break  # expected start bit
-        if i + 9 >= n:
-            break
-        # 8 data bits
-        val = 0
-        # NOTE: sender bit order could be MSB-first or LSB-first; we try both later.
-        data_bits = bits[i + 1:i + 9]
-        stop = bits[i + 9]
-        if stop != 1:
-            break
+    nbytes = max(0, min(max_bytes, (len(bits) - start_pos) // 10))
+    frame = np.asarray(bits[start_pos:start_pos + 10 * nbytes], dtype=np.uint8).reshape(nbytes, 10)
+
+    # start bit must be 0, stop bit must be 1; stop at the first broken frame
+    invalid = (frame[:, 0] != 0) | (frame[:, 9] != 1)
+    valid = int(np.argmax(invalid)) if invalid.any() else nbytes
 
-        # provisional: treat as MSB-first
-        for b in data_bits:
-            val = (val << 1) | (b & 1)
+    # provisional: treat as MSB-first
+    # NOTE: sender bit order could be MSB-first or LSB-first; we try both later.
+    out = np.packbits(frame[:valid, 1:9], axis=1, bitorder="big").ravel()
+    return out.tobytes(), start_pos + 10 * valid
 
-        out.append(val)
-        i += 10
 
-    return bytes(out), i
+# CRC16 is affine in its init value, so for the same body
+#   crc16_ccitt_false(body) == crc16_xmodem(body) ^ crc16_ccitt_false(b"\x00" * len(body))
+# The zero-body term depends only on the length; cache it per length.
+# (A length seen for the first time still costs one extra CRC pass over zeros.)
+@functools.lru_cache(maxsize=64)
+def _ccitt_init_adjust(n: int) -> int:
+    return crc16_ccitt_false(bytes(n))
 
 
 def try_bit_order_and_crc(payload: bytes) -> Optional[bytes]:
@@ -145,84 +249,78 @@ def try_bit_order_and_crc(payload: bytes) -> Optional[bytes]:
     if len(payload) < 3:
         return None
 
-    def reverse_bits_in_byte(b: int) -> int:
-        x = b
-        r = 0
-        for _ in range(8):
-            r = (r << 1) | (x & 1)
-            x >>= 1
-        return r
-
-    candidates = []
-
-    # Candidate A: as-is
-    candidates.append(payload)
+    payload_u8 = np.frombuffer(payload, dtype=np.uint8)
+    adj = _ccitt_init_adjust(len(payload) - 2)
 
-    # Candidate B: bit-reversed per byte (UART might have been LSB-first)
-    candidates.append(bytes(reverse_bits_in_byte(b) for b in payload))
-
-    for cand in candidates:
-        if len(cand) < 3:
-            continue
+    def check(cand: np.ndarray) -> Optional[bytes]:
         body, crc_bytes = cand[:-2], cand[-2:]
-        want = (crc_bytes[0] << 8) | crc_bytes[1]
+        want = (int(crc_bytes[0]) << 8) | int(crc_bytes[1])
 
-        for crc_fn in (crc16_xmodem, crc16_ccitt_false):
-            got = crc_fn(body)
-            if got == want:
-                return body
+        # one CRC pass covers both XMODEM (init=0x0000) and CCITT-FALSE (init=0xFFFF)
+        got = crc16_xmodem_np(body)
+        if got == want or (got ^ adj) == want:
+            return body.tobytes()
+        return None
 
-    return None
+    # Candidate A: as-is (MSB-first, as sent by encoder.py)
+    body = check(payload_u8)
+    if body is None:
+        # Candidate B: bit-reversed per byte (UART might have been LSB-first)
+        body = check(_BIT_REV_NP[payload_u8])
+    return body
 
 
-def find_frames(bits: List[int]) -> List[int]:
+def find_frames(bits: np.ndarray) -> np.ndarray:
     """
     Heuristic: find candidate start positions by looking for long runs of 1s (preamble),
     followed by a 0 (start bit) soon after.
-    Returns list of candidate bit indices that likely point at a UART start bit.
+    Returns int64 array of candidate bit indices that likely point at a UART start bit.
     """
-    starts = []
-    n = len(bits)
-    run = 0
-    for i in range(n):
-        if bits[i] == 1:
-            run += 1
-        else:
-            # if we had a long run of 1s, and now we see 0, consider i as a start bit
-            if run >= 8:  # tolerant (spec often ~12)
-                starts.append(i)
-            run = 0
-
-    # de-duplicate nearby starts
+    # the run of 1s before each 0 is the gap to the previous 0
+    zeros = np.flatnonzero(np.asarray(bits) == 0)
+    run = np.diff(zeros, prepend=-1) - 1
+    starts = zeros[run >= 8]  # tolerant (spec often ~12)
+
+    # de-duplicate nearby starts (only a handful of candidates survive the run filter)
     dedup = []
     last = -10**9
-    for s in starts:
+    for s in starts.tolist():
         if s - last > 50:  # separate frames
             dedup.append(s)
             last = s
-    return dedup
+    return np.asarray(dedup, dtype=np.int64)
 
 
 def decode_config_string(wav_path: str) -> str:
-    pcm, rate = read_wav_int16(wav_path)
-
-    # chop into 32-sample blocks
-    n_blocks = len(pcm) // BIT_SAMPLES
-    if n_blocks < 200:
-        raise ValueError("WAV too short to contain a valid frame")
-
-    blocks = pcm[:n_blocks * BIT_SAMPLES].reshape(n_blocks, BIT_SAMPLES)
-    blocks_n = normalize_blocks(blocks)
-
-    # learn 2 waveforms by k-means
-    centroids, labels = kmeans2(blocks_n, iters=40, seed=1)
+    with wave.open(wav_path, "rb") as wf:
+        _check_sample_width(wf)
+        n_blocks = wf.getnframes() // BIT_SAMPLES
+        if n_blocks < 200:
+            raise ValueError("WAV too short to contain a valid frame")
+
+        # learn 2 waveforms by k-means on calibration blocks sampled across the file,
+        # keeping only blocks with signal energy (silence / low noise would
+        # otherwise normalize into a cluster of their own)
+        calib = read_calibration_blocks(wf, n_blocks)
+        energy = calib.var(axis=1)
+        voiced = energy > CALIBRATION_ENERGY_RATIO * np.percentile(energy, CALIBRATION_ENERGY_PERCENTILE)
+        if voiced.any():
+            calib = calib[voiced]
+        centroids, _ = kmeans2(normalize_blocks(calib), iters=12, seed=1)
+
+        # Convert each block to a bit by nearest centroid, streaming the file
+        # so only the labels (1 byte per bit) stay in memory.
+        w, b = split_plane(centroids)
+        bit_chunks = []
+        for start in range(0, n_blocks, STREAM_BLOCKS):
+            blocks = normalize_blocks(read_wav_blocks(wf, start, STREAM_BLOCKS))
+            bit_chunks.append((blocks @ w > b).astype(np.uint8))
 
-    # Convert each block to a bit by nearest centroid (0/1 labels already do that).
     # But we don't know whether label==1 corresponds to logical '1'. We'll try both mappings.
-    raw_bits = labels.tolist()  # 0/1 but unknown polarity
+    raw_bits = np.concatenate(bit_chunks)  # 0/1 but unknown polarity
 
     def decode_with_polarity(flip: bool) -> Optional[str]:
-        bits = [(1 - b) if flip else b for b in raw_bits]
+        bits = raw_bits ^ np.uint8(1) if flip else raw_bits
 
         # find candidate frame starts
         starts = find_frames(bits)
@@ -2,9 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import functools
 import wave
+from array import array
 from pathlib import Path
 
+import numpy as np
+
 # ===== 固定（32サンプル波形テンプレ：Proのオリジナルから実測）=====
 # bit = 1（4サンプル周期 × 8）
 BIT1 = [
@@ -42,37 +46,46 @@ DEVICE_SAMPLE_RATE = {
 }
 
 # ===== CRC16 XMODEM =====
-def crc16_xmodem(data: bytes) -> int:
-    crc = 0x0000
-    for b in data:
-        crc ^= (b << 8)
+def _make_crc16_table(poly: int) -> array:
+    # Sarwate table: CRC of each possible leading byte, run through the bit loop once
+    table = array("H")
+    for b in range(256):
+        crc = b << 8
         for _ in range(8):
             if crc & 0x8000:
-                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+                crc = ((crc << 1) ^ poly) & 0xFFFF
             else:
                 crc = (crc << 1) & 0xFFFF
-    return crc
+        table.append(crc)
+    return table
 
 
-def uart_bits(payload: bytes) -> list[int]:
-    """UART framing: start=0, data=8bit MSB-first, stop=1"""
-    bits: list[int] = []
-    for b in payload:
-        bits.append(0)  # start
-        for i in range(7, -1, -1):  # MSB-first
-            bits.append((b >> i) & 1)
-        bits.append(1)  # stop
-    return bits
+_CRC16_XMODEM_TABLE = _make_crc16_table(0x1021)
 
 
-def bits_to_pcm(bits: list[int], amp_scale: float) -> bytes:
-    """
-    Convert bitstream to PCM (int16 LE bytes).
-    amp_scale: 0.0-1.0. 1.0 keeps original template amplitude.
-    """
-    if not (0.0 < amp_scale <= 1.0):
-        raise ValueError("amp_scale must be in (0.0, 1.0].")
+def crc16_xmodem(data: bytes) -> int:
+    table = _CRC16_XMODEM_TABLE
+    crc = 0x0000
+    for b in data:
+        crc = ((crc << 8) ^ table[((crc >> 8) ^ b) & 0xFF]) & 0xFFFF
+    return crc
 
+
+def uart_bits(payload: bytes) -> np.ndarray:
+    """UART framing: start=0, data=8bit MSB-first, stop=1"""
+    b = np.frombuffer(payload, dtype=np.uint8)
+    data = np.unpackbits(b, bitorder="big").reshape(-1, 8)  # MSB-first
+    frame = np.concatenate([
+        np.zeros((len(b), 1), dtype=np.uint8),  # start
+        data,
+        np.ones((len(b), 1), dtype=np.uint8),  # stop
+    ], axis=1)
+    return frame.ravel()
+
+
+@functools.lru_cache(maxsize=8)
+def _scaled_templates(amp_scale: float) -> np.ndarray:
+    """Scaled bit0/bit1 templates as an int16 LE table[2, 32], cached per amp_scale."""
     # scale templates (keep integers)
     def scale(arr):
         out = []
@@ -83,16 +96,26 @@ def bits_to_pcm(bits: list[int], amp_scale: float) -> bytes:
             out.append(sv)
         return out
 
-    b0 = scale(BIT0)
-    b1 = scale(BIT1)
+    b0 = np.array(scale(BIT0), dtype="<i2")
+    b1 = np.array(scale(BIT1), dtype="<i2")
+    table = np.stack([b0, b1], axis=0)  # (2, 32): row 0 = bit 0, row 1 = bit 1
+    table.flags.writeable = False  # shared by every caller through the cache
+    return table
+
+
+def bits_to_pcm(bits: np.ndarray, amp_scale: float) -> bytes:
+    """
+    Convert bitstream to PCM (int16 LE bytes).
+    amp_scale: 0.0-1.0. 1.0 keeps original template amplitude.
+    """
+    if not (0.0 < amp_scale <= 1.0):
+        raise ValueError("amp_scale must be in (0.0, 1.0].")
+
+    table = _scaled_templates(float(amp_scale))
 
-    # build bytearray directly (faster & simpler)
-    out = bytearray()
-    for b in bits:
-        tmpl = b1 if b else b0
-        for s in tmpl:
-            out += int(s).to_bytes(2, "little", signed=True)
-    return bytes(out)
+    # one 32-sample template row per bit, gathered in a single pass
+    sel = (np.asarray(bits) != 0).astype(np.uint8)
+    return table[sel].tobytes()
 
 
 def main():
@@ -114,10 +137,12 @@ def main():
     crc = crc16_xmodem(payload)
     payload += bytes([(crc >> 8) & 0xFF, crc & 0xFF])  # MSB->LSB
 
-    bits = [1] * PREAMBLE_ONES
-    bits += uart_bits(payload)
-    bits += [1] * POSTAMBLE_ONES
-    bits *= REPEAT
+    bits = np.concatenate([
+        np.ones(PREAMBLE_ONES, dtype=np.uint8),
+        uart_bits(payload),
+        np.ones(POSTAMBLE_ONES, dtype=np.uint8),
+    ])
+    bits = np.tile(bits, REPEAT)
 
     pcm_bytes = bits_to_pcm(bits, amp_scale=args.amp)
 